@@ -1,20 +1,72 @@
 import sounddevice as sd
-from scipy.io.wavfile import write
-from sentence_transformers import util
+import numpy as np
+import torch
 import json
-import random
+import threading
+import hashlib
+from collections import OrderedDict, deque
+from functools import lru_cache
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    import webrtcvad
+except ImportError:
+    # Without the VAD we just record for the full duration
+    webrtcvad = None
+
+def cosine_similarity(a, b):
+    """How similar two embeddings are (1 = same meaning). 'b' can be float16."""
+    if simsimd is not None:
+        # Fast path: simsimd gives the distance, so flip it
+        return 1.0 - float(simsimd.cosine(np.asarray(a, dtype=b.dtype), b))
+    # Both vectors have length 1, so a dot product is enough
+    return float(np.dot(a, b.astype(np.float32)))
 
 class AudioAutoGrader:
     def __init__(self, stt_model, nlp_model, questions_file="questions.json"):
         self.stt_model = stt_model
         self.nlp_model = nlp_model
         self.questions = self.load_questions(questions_file)
+        # Lowercase the references once here rather than on every grade
+        for q in self.questions:
+            q["reference_lc"] = q["reference"].lower()
+        self._rng = np.random.default_rng()
+        self._question_order = self.new_question_order()
+        # Reference embeddings live in one (N, 384) matrix; ids map to rows (unique ids only)
+        ids = [q["id"] for q in self.questions]
+        self._q_row = {qid: row for row, qid in enumerate(ids) if ids.count(qid) == 1}
+        self.q_ref_embs = self.encode_references()
+        self.prompt_tokens = self.tokenize_prompts()
+
+        # Small LRU caches so identical audio / answers aren't processed twice
+        self._transcripts = OrderedDict()
+        self._transcripts_lock = threading.Lock()
+        self._encode_cached = lru_cache(maxsize=128)(self._encode)
 
     def load_questions(self, filepath):
         """Load questions from the JSON file. Use a default if it fails."""
         try:
             with open(filepath, 'r') as f:
-                return json.load(f)
+                questions = json.load(f)
+            # Every question needs an id and text fields, otherwise fall back like a broken file
+            if not questions:
+                raise ValueError("the file has no questions")
+            for q in questions:
+                bad = [k for k in ("id", "question", "reference", "keywords")
+                       if k not in q or (k != "id" and not isinstance(q[k], str))]
+                if bad:
+                    raise ValueError(f"question {q.get('id', '?')} has missing or invalid {', '.join(bad)}")
+            # Copy-pasted blocks often keep the old id; those questions can't be looked up by id
+            ids = [q.get("id") for q in questions]
+            duplicates = sorted({str(i) for i in ids if ids.count(i) > 1})
+            if duplicates:
+                print(f"Warning: duplicate question ids in {filepath}: {', '.join(duplicates)}. "
+                      "Those questions are graded from their reference text instead.")
+            return questions
         except Exception as e:
             print(f"Error loading questions: {e}")
             # Return a simple backup question so the app doesn't crash
@@ -25,42 +77,131 @@ class AudioAutoGrader:
                 "keywords": "study, life, organisms"
             }]
 
-    def get_random_question(self):
-        return random.choice(self.questions)
+    def encode_references(self):
+        """Embed every reference answer once, so grading only has to encode the student."""
+        with torch.inference_mode():
+            embeddings = self.nlp_model.encode(
+                [q["reference_lc"] for q in self.questions],
+                convert_to_numpy=True, batch_size=16, normalize_embeddings=True
+            )
+        # float16 halves the memory; the score barely changes
+        return np.ascontiguousarray(embeddings, dtype=np.float16)
+
+    def tokenize_prompts(self):
+        """Turn each question's keywords into Whisper prompt tokens once (faster-whisper only)."""
+        tokenizer = getattr(self.stt_model, "hf_tokenizer", None)
+        if tokenizer is None:
+            return {}
+        return {
+            qid: tokenizer.encode(" " + self.questions[row]["keywords"].strip(), add_special_tokens=False).ids
+            for qid, row in self._q_row.items()
+        }
+
+    def new_question_order(self):
+        """A shuffled cycle of question positions."""
+        return deque(self._rng.permutation(len(self.questions)).tolist())
 
-    def record_audio(self, duration=10, filename="student_response.wav"):
-        """Records audio from the microphone."""
+    def next_question(self, order=None):
+        """Next question in the cycle (the grader's own one unless 'order' is given). No repeats per round."""
+        if order is None:
+            order = self._question_order
+        i = order.popleft()
+        order.append(i)
+        return self.questions[i]
+
+    def record_audio(self, duration=10, silence_limit=1.0):
+        """
+        Records audio from the microphone until the student stops talking (or 'duration' runs out).
+        Returns the audio as a float32 array that can go straight into transcribe().
+        """
         try:
-            fs = 44100 # Sample rate (standard for audio)
-            recording = sd.rec(int(duration * fs), samplerate=fs, channels=1, dtype='float32')
-            sd.wait()
-            write(filename, fs, recording)
-            return filename
+            fs = 16000 # Sample rate Whisper expects, so no resampling is needed
+            frame_size = 480 # 30 ms frames, one of the sizes WebRTC VAD accepts
+            vad = webrtcvad.Vad(2) if webrtcvad is not None else None
+            frames = []
+            state = {"speech_seen": False, "silence": 0.0}
+            finished = threading.Event()
+
+            def on_audio(indata, frame_count, time_info, status):
+                frame = indata.copy()
+                frames.append(frame)
+                if vad is None:
+                    return
+                if vad.is_speech(frame.tobytes(), fs):
+                    state["speech_seen"] = True
+                    state["silence"] = 0.0
+                elif state["speech_seen"]:
+                    state["silence"] += frame_count / fs
+                    # Stop early once the student has gone quiet after answering
+                    if state["silence"] >= silence_limit:
+                        finished.set()
+
+            with sd.InputStream(samplerate=fs, channels=1, dtype='int16', blocksize=frame_size, callback=on_audio):
+                finished.wait(timeout=duration)
+
+            recording = np.concatenate(frames) if frames else np.zeros((0, 1), dtype=np.int16)
+            return recording.flatten().astype(np.float32) / 32768.0
         except Exception as e:
             print(f"Recording error: {e}")
             return None
 
-    def transcribe(self, audio_path, context_keywords=""):
-        """Converts audio to text using AI."""
+    def transcribe(self, audio, context_keywords="", question_id=None):
+        """Converts audio (16 kHz float32 array) to text using AI."""
         try:
-            result = self.stt_model.transcribe(audio_path, fp16=False, initial_prompt=context_keywords)
-            return result["text"].strip()
+            # Same audio + same hint = same text, so look it up by a hash of the samples
+            key = (hashlib.blake2b(audio.tobytes(), digest_size=16).hexdigest(), question_id, context_keywords)
+            with self._transcripts_lock:
+                if key in self._transcripts:
+                    self._transcripts.move_to_end(key)
+                    return self._transcripts[key]
+
+            prompt = self.prompt_tokens.get(question_id, context_keywords)
+            # Beam search only for long answers (over 20 s at 16 kHz); greedy is enough otherwise
+            beam_size = 5 if len(audio) > 20 * 16000 else 1
+            # English only - also avoids language detection crashing on silent recordings
+            segments, _ = self.stt_model.transcribe(
+                audio, language="en", initial_prompt=prompt, beam_size=beam_size, vad_filter=True,
+                without_timestamps=True, condition_on_previous_text=False
+            )
+            text = " ".join(segment.text for segment in segments).strip()
+
+            with self._transcripts_lock:
+                self._transcripts[key] = text
+                if len(self._transcripts) > 128:
+                    self._transcripts.popitem(last=False)
+            return text
         except Exception as e:
             print(f"Transcription error: {e}")
             return ""
 
-    def grade_response(self, student_text, reference_answer, threshold=0.65):
-        """Grades the answer by comparing meanings (Semantic Similarity)."""
+    def _encode(self, text):
+        """Embedding of one sentence, normalized to length 1."""
+        return self.nlp_model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+
+    def grade_response(self, student_text, reference_answer, threshold=0.65, question_id=None):
+        """
+        Grades the answer by comparing meanings (Semantic Similarity).
+        'reference_answer' should already be lowercase - pass the question's 'reference_lc'.
+        """
         if not student_text:
             return {"grade": 0, "similarity_score": 0, "status": "FAIL"}
 
-        # 1. Convert text to numbers (Embeddings)
-        emb1 = self.nlp_model.encode(student_text.lower(), convert_to_tensor=True)
-        emb2 = self.nlp_model.encode(reference_answer.lower(), convert_to_tensor=True)
+        # 1. Convert text to numbers (Embeddings), reusing the cached reference if we have it
+        # (inference_mode: no gradients needed, so skip building the autograd graph)
+        with torch.inference_mode():
+            row = self._q_row.get(question_id)
+            if row is not None:
+                emb1 = self._encode_cached(student_text.lower())
+                emb2 = self.q_ref_embs[row]
+            else:
+                # Otherwise encode both sentences together in one batch
+                emb1, emb2 = self.nlp_model.encode(
+                    [student_text.lower(), reference_answer],
+                    convert_to_numpy=True, batch_size=2, normalize_embeddings=True
+                )
 
         # 2. Calculate how close the numbers are (Cosine Similarity)
-        # .item() just extracts the single number from the result
-        score = util.cos_sim(emb1, emb2).item()
+        score = cosine_similarity(emb1, emb2)
         
         # 3. Convert to percentage
         grade = max(0, score) * 100
@@ -1,12 +1,31 @@
 import streamlit as st
-import whisper
-from sentence_transformers import SentenceTransformer, util
-import sounddevice as sd
-from scipy.io.wavfile import write
 import os
-import random
+import io
 import numpy as np
 import logging
+import threading
+import hashlib
+from collections import OrderedDict, deque
+from functools import lru_cache
+from onnx_encoder import OnnxSentenceEncoder, onnx_model_available
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# Whisper works on 16 kHz mono audio, so record at that rate to avoid resampling later.
+SAMPLE_RATE = 16000
+# WebRTC VAD only accepts 10/20/30 ms frames; 480 samples is 30 ms at 16 kHz.
+VAD_FRAME_SIZE = 480
+# Answers longer than this are decoded with beam search; shorter ones greedily.
+BEAM_SEARCH_MIN_SECONDS = 20
+# Optional locally converted, int8-quantized Whisper model (see README).
+WHISPER_CT2_DIR = "whisper_ct2"
+# One thread budget for torch, CTranslate2 and ONNX Runtime; oversubscription hurts small CPU models.
+NUM_THREADS = min(os.cpu_count() or 4, 8)
+# How many transcripts / student embeddings to remember for repeated submissions.
+CACHE_SIZE = 128
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="AI Oral Quiz Grader", page_icon="🎤", layout="centered")
@@ -16,112 +35,311 @@ st.set_page_config(page_title="AI Oral Quiz Grader", page_icon="🎤", layout="c
 @st.cache_resource
 def load_models():
     print("Loading AI models...")
-    stt_model = whisper.load_model("small")
-    nlp_model = SentenceTransformer("all-MiniLM-L6-v2")
+    # Heavy libraries are imported here rather than at the top of the file: Streamlit
+    # re-executes this script on every interaction, and torch alone takes seconds to import.
+    import torch
+    from faster_whisper import WhisperModel
+    from sentence_transformers import SentenceTransformer
+
+    # Match PyTorch's thread pool to the machine
+    torch.set_num_threads(NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before any parallel work has started in this process
+        pass
+
+    # Use a local GPU whenever there is one; both models fit comfortably in 8 GB
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # CTranslate2 backend with int8 weights runs several times faster than PyTorch on CPU.
+    # Prefer a model already quantized to int8 on disk: smaller and no conversion at load time.
+    stt_source = WHISPER_CT2_DIR if os.path.isdir(WHISPER_CT2_DIR) else "small"
+    # On GPU, int8 weights with float16 activations run on Tensor Cores about twice as fast as plain float16
+    compute_type = "int8_float16" if device == "cuda" else "int8"
+    stt_model = WhisperModel(
+        stt_source, device=device, compute_type=compute_type,
+        num_workers=1, cpu_threads=NUM_THREADS
+    )
+    if device == "cpu" and onnx_model_available():
+        # int8-quantized ONNX export of MiniLM (see onnx_encoder.py), much faster on CPU
+        nlp_model = OnnxSentenceEncoder(num_threads=NUM_THREADS)
+    else:
+        nlp_model = SentenceTransformer("all-MiniLM-L6-v2", device=device)
+        nlp_model.eval()
+
+    # Push one second of silence and two short sentences through the models now, while the
+    # loading spinner is still up, so the first student doesn't pay for one-time initialization.
+    try:
+        # Same decoding options as transcribe(), minus vad_filter: on pure silence the VAD would
+        # drop everything and the encoder/decoder would never run.
+        segments, _ = stt_model.transcribe(
+            np.zeros(SAMPLE_RATE, dtype=np.float32), language="en", beam_size=1,
+            without_timestamps=True, condition_on_previous_text=False
+        )
+        list(segments)  # faster-whisper only decodes once the segments are consumed
+        # The Silero VAD session behind vad_filter=True is loaded lazily on first use; load it now
+        from faster_whisper.vad import get_vad_model
+        get_vad_model()
+    except Exception as e:
+        logging.warning(f"Whisper warm-up failed: {e}")
+    try:
+        nlp_model.encode(["warmup sentence one", "warmup sentence two"], convert_to_numpy=True)
+    except Exception as e:
+        logging.warning(f"Embedding model warm-up failed: {e}")
     return stt_model, nlp_model
 
+def cosine_similarity(a, b):
+    """
+    Cosine similarity of two embedding vectors (SIMD-accelerated when simsimd is installed).
+    'b' may be a float16 reference embedding; 'a' is cast to match.
+    """
+    if simsimd is not None:
+        # simsimd works on float16 natively and returns the cosine *distance*
+        return 1.0 - float(simsimd.cosine(np.asarray(a, dtype=b.dtype), b))
+    # Embeddings are already unit length, so the dot product is the cosine
+    return float(np.dot(a, b.astype(np.float32)))
+
+# --- QUESTION BANK ---
+# In a real production app, this would likely come from a database or JSON file.
+# Defined once at module level so it isn't rebuilt every time the grader is constructed.
+QUESTIONS = [
+    {
+        "id": 1, "question": "Explain the process by which plants make their own food.",
+        "reference": "Plants use photosynthesis to convert sunlight, water, and carbon dioxide into energy and food.",
+        "keywords": "photosynthesis, sunlight, carbon dioxide, chlorophyll, glucose"
+    },
+    {
+        "id": 2, "question": "What is the largest organ in the human body and what is its purpose?",
+        "reference": "The skin is the largest organ in the human body, acting as a protective barrier against the environment.",
+        "keywords": "skin, organ, human body, protection, barrier"
+    },
+    {
+        "id": 3, "question": "Describe the basic building blocks of life.",
+        "reference": "Cells are the fundamental building blocks of all living organisms and carry out all life processes.",
+        "keywords": "cells, building blocks, organisms, microscopic"
+    },
+    {
+        "id": 4, "question": "Which part of a cell houses the genetic material or DNA?",
+        "reference": "The nucleus is the cell organelle that contains DNA and coordinates cell activities.",
+        "keywords": "nucleus, DNA, genetic material, organelle, chromosomes"
+    },
+    {
+        "id": 5, "question": "Explain the process of transpiration in plants.",
+        "reference": "Transpiration is the process where water travels through a plant and evaporates from the leaves.",
+        "keywords": "transpiration, evaporation, leaves, xylem, water movement"
+    },
+    {
+        "id": 6, "question": "What is a carbohydrate and why does the body need it?",
+        "reference": "Carbohydrates are organic compounds like sugars and starches that provide the body with energy.",
+        "keywords": "carbohydrate, sugar, starch, energy, glucose"
+    },
+    {
+        "id": 7, "question": "What is the primary function of the heart in the human body?",
+        "reference": "The heart acts as a pump that circulates blood throughout the body to deliver oxygen and nutrients.",
+        "keywords": "heart, pump, blood, circulation, oxygen, nutrients"
+    },
+    {
+        "id": 8, "question": "Briefly describe the process of binary fission.",
+        "reference": "Binary fission is a type of asexual reproduction where a single cell divides into two identical daughter cells.",
+        "keywords": "binary fission, asexual reproduction, division, identical, bacteria"
+    },
+    {
+        "id": 9, "question": "Define the scientific study of biology.",
+        "reference": "Biology is the branch of science that deals with the study of living organisms and their life processes.",
+        "keywords": "biology, science, living organisms, life processes"
+    },
+    {
+        "id": 10, "question": "What are some of the key characteristics that define a living thing?",
+        "reference": "Living things are defined by their ability to grow, reproduce, move, and respond to stimuli in their environment.",
+        "keywords": "growth, reproduction, movement, stimuli, metabolism"
+    }
+]
+
 # --- CORE LOGIC ---
 class AudioAutoGrader:
     def __init__(self):
         """Initialize the grader with cached AI models and the question bank."""
         self.stt_model, self.nlp_model = load_models()
-        
-        # In a real production app, this would likely come from a database or JSON file.
-        self.questions = [
-            {
-                "id": 1, "question": "Explain the process by which plants make their own food.",
-                "reference": "Plants use photosynthesis to convert sunlight, water, and carbon dioxide into energy and food.",
-                "keywords": "photosynthesis, sunlight, carbon dioxide, chlorophyll, glucose"
-            },
-            {
-                "id": 2, "question": "What is the largest organ in the human body and what is its purpose?",
-                "reference": "The skin is the largest organ in the human body, acting as a protective barrier against the environment.",
-                "keywords": "skin, organ, human body, protection, barrier"
-            },
-            {
-                "id": 3, "question": "Describe the basic building blocks of life.",
-                "reference": "Cells are the fundamental building blocks of all living organisms and carry out all life processes.",
-                "keywords": "cells, building blocks, organisms, microscopic"
-            },
-            {
-                "id": 4, "question": "Which part of a cell houses the genetic material or DNA?",
-                "reference": "The nucleus is the cell organelle that contains DNA and coordinates cell activities.",
-                "keywords": "nucleus, DNA, genetic material, organelle, chromosomes"
-            },
-            {
-                "id": 5, "question": "Explain the process of transpiration in plants.",
-                "reference": "Transpiration is the process where water travels through a plant and evaporates from the leaves.",
-                "keywords": "transpiration, evaporation, leaves, xylem, water movement"
-            },
-            {
-                "id": 6, "question": "What is a carbohydrate and why does the body need it?",
-                "reference": "Carbohydrates are organic compounds like sugars and starches that provide the body with energy.",
-                "keywords": "carbohydrate, sugar, starch, energy, glucose"
-            },
-            {
-                "id": 7, "question": "What is the primary function of the heart in the human body?",
-                "reference": "The heart acts as a pump that circulates blood throughout the body to deliver oxygen and nutrients.",
-                "keywords": "heart, pump, blood, circulation, oxygen, nutrients"
-            },
-            {
-                "id": 8, "question": "Briefly describe the process of binary fission.",
-                "reference": "Binary fission is a type of asexual reproduction where a single cell divides into two identical daughter cells.",
-                "keywords": "binary fission, asexual reproduction, division, identical, bacteria"
-            },
-            {
-                "id": 9, "question": "Define the scientific study of biology.",
-                "reference": "Biology is the branch of science that deals with the study of living organisms and their life processes.",
-                "keywords": "biology, science, living organisms, life processes"
-            },
-            {
-                "id": 10, "question": "What are some of the key characteristics that define a living thing?",
-                "reference": "Living things are defined by their ability to grow, reproduce, move, and respond to stimuli in their environment.",
-                "keywords": "growth, reproduction, movement, stimuli, metabolism"
-            }
-        ]
-
-    def get_random_question(self):
-        return random.choice(self.questions)
-
-    def record_audio(self, duration=10, filename="student_response.wav", fs=44100):
-        """Captures audio from the default input device and saves to disk."""
+        # Copies of the bank entries with the lowercased reference (what actually gets embedded)
+        # worked out once, instead of calling .lower() on every grade
+        self.questions = [dict(q, reference_lc=q["reference"].lower()) for q in QUESTIONS]
+        self._rng = np.random.default_rng()
+        self._question_order = self.new_question_order()
+
+        # Re-submitting identical audio (e.g. a mis-click on a silent recording) skips Whisper
+        self._transcripts = OrderedDict()
+        self._transcripts_lock = threading.Lock()
+        self._encode_cached = lru_cache(maxsize=CACHE_SIZE)(self._encode)
+
+        # The reference answers are fixed, so embed them once (in a single batch) up front
+        # instead of re-encoding the reference on every grading call. They are kept as one
+        # (N, 384) matrix, with question ids mapped to row numbers.
+        self._q_row = {q["id"]: row for row, q in enumerate(self.questions)}
+        self.q_ref_embs = self.encode_references()
+
+        # Likewise, the Whisper prompt for each question never changes, so tokenize it once
+        self.prompt_tokens = self.tokenize_prompts()
+
+    def encode_references(self):
+        """Pre-computes normalized embeddings of every reference answer, one row per question."""
+        import torch
+
+        with torch.inference_mode():
+            embeddings = self.nlp_model.encode(
+                [q["reference_lc"] for q in self.questions],
+                convert_to_numpy=True, batch_size=16, normalize_embeddings=True
+            )
+        # Stored as float16: half the memory per reference, and no visible effect on the score
+        return np.ascontiguousarray(embeddings, dtype=np.float16)
+
+    def tokenize_prompts(self):
+        """
+        Pre-tokenizes each question's keywords into Whisper prompt token ids, keyed by question id.
+        faster-whisper accepts these ids as 'initial_prompt' and skips its own BPE encoding.
+        """
+        tokenizer = getattr(self.stt_model, "hf_tokenizer", None)
+        if tokenizer is None:
+            return {}
+        # Same formatting faster-whisper applies to a string prompt
+        return {
+            q["id"]: tokenizer.encode(" " + q["keywords"].strip(), add_special_tokens=False).ids
+            for q in self.questions
+        }
+
+    def new_question_order(self):
+        """
+        A freshly shuffled cycle of question indices. The grader is shared by every session,
+        so each session keeps its own cycle (in st.session_state) and passes it back in.
+        """
+        return deque(self._rng.permutation(len(self.questions)).tolist())
+
+    def next_question(self, order=None):
+        """
+        Next question from a shuffled cycle; no repeats until the whole bank has been asked.
+        Pass the session's own cycle - without one, the grader-wide cycle (shared by everyone) is used.
+        """
+        if order is None:
+            order = self._question_order
+        i = order.popleft()
+        order.append(i)
+        return self.questions[i]
+
+    def record_audio(self, duration=10, silence_limit=1.0):
+        """
+        Captures audio from the default input device and returns it as a float32
+        array at 16 kHz (the format Whisper consumes directly, so nothing touches disk).
+        Recording stops once the student has been silent for 'silence_limit' seconds
+        after speaking; 'duration' is only the upper bound.
+        """
         try:
-            # Record raw audio data as float32 for better compatibility
-            recording = sd.rec(int(duration * fs), samplerate=fs, channels=1, dtype='float32')
-            sd.wait()
-            write(filename, fs, recording)
-            return filename
+            # Imported lazily; this also avoids probing the audio devices at app import time
+            import sounddevice as sd
+            try:
+                import webrtcvad
+                vad = webrtcvad.Vad(2)
+            except ImportError as e:
+                # No VAD available: still record, just for the full 'duration'
+                logging.warning(f"Voice activity detection unavailable, recording full duration: {e}")
+                vad = None
+
+            frames = []
+            state = {"speech_seen": False, "silence": 0.0}
+            finished = threading.Event()
+
+            def on_audio(indata, frame_count, time_info, status):
+                frame = indata.copy()
+                frames.append(frame)
+                if vad is None:
+                    return
+                if vad.is_speech(frame.tobytes(), SAMPLE_RATE):
+                    state["speech_seen"] = True
+                    state["silence"] = 0.0
+                elif state["speech_seen"]:
+                    state["silence"] += frame_count / SAMPLE_RATE
+                    if state["silence"] >= silence_limit:
+                        finished.set()
+
+            # Stream 16-bit PCM at Whisper's native rate in 30 ms blocks the VAD can judge
+            with sd.InputStream(samplerate=SAMPLE_RATE, channels=1, dtype='int16',
+                                blocksize=VAD_FRAME_SIZE, callback=on_audio):
+                finished.wait(timeout=duration)
+
+            recording = np.concatenate(frames) if frames else np.zeros((0, 1), dtype=np.int16)
+            return recording.flatten().astype(np.float32) / 32768.0
         except Exception as e:
             logging.error(f"Audio recording failed: {e}")
             return None
 
-    def transcribe(self, audio_path, context_keywords=""):
+    def transcribe(self, audio, context_keywords="", question_id=None):
         """
-        Uses OpenAI Whisper to convert speech to text.
+        Uses Whisper (via faster-whisper) to convert a 16 kHz float32 audio array to text.
         'context_keywords' provides a hint to the model for domain-specific terms.
+        If 'question_id' is given, the pre-tokenized keywords for that question are used instead.
         """
         try:
-            result = self.stt_model.transcribe(audio_path, fp16=False, initial_prompt=context_keywords)
-            return result["text"].strip()
+            # Key the cache on the audio content
+            key = (hashlib.blake2b(audio.tobytes(), digest_size=16).hexdigest(), question_id, context_keywords)
+            with self._transcripts_lock:
+                if key in self._transcripts:
+                    self._transcripts.move_to_end(key)
+                    return self._transcripts[key]
+
+            prompt = self.prompt_tokens.get(question_id, context_keywords)
+            # Greedy decoding is plenty for short answers; only pay for beam search on long ones
+            beam_size = 5 if len(audio) / SAMPLE_RATE > BEAM_SEARCH_MIN_SECONDS else 1
+            # vad_filter skips the silent stretches while the student is thinking;
+            # we only need the text, so don't spend decoder steps on timestamp tokens.
+            # A single short answer has no earlier window worth conditioning on.
+            # The quiz is in English: fixing the language skips detection (an extra encoder pass),
+            # which also fails outright when the VAD finds no speech in a silent recording
+            segments, _ = self.stt_model.transcribe(
+                audio, language="en", initial_prompt=prompt, beam_size=beam_size, vad_filter=True,
+                without_timestamps=True, condition_on_previous_text=False
+            )
+            text = " ".join(segment.text for segment in segments).strip()
+
+            with self._transcripts_lock:
+                self._transcripts[key] = text
+                if len(self._transcripts) > CACHE_SIZE:
+                    self._transcripts.popitem(last=False)
+            return text
         except Exception as e:
             logging.error(f"Transcription failed: {e}")
             return ""
 
-    def grade_response(self, student_text, reference_answer, threshold=0.65):
+    def _encode(self, text):
+        """Normalized embedding of a single piece of text (wrapped in an LRU cache in __init__)."""
+        return self.nlp_model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+
+    def grade_response(self, student_text, reference_answer, threshold=0.65, question_id=None):
         """
         Grades the response by calculating the semantic similarity between the 
         student's answer and the reference key.
+        'reference_answer' is expected lowercased already (the question's 'reference_lc').
+        If 'question_id' is given, the pre-computed reference embedding is reused.
         """
         if not student_text:
             return {"grade": 0, "similarity_score": 0, "status": "FAIL"}
 
-        # Convert text to vector embeddings to capture semantic meaning
-        embedding_1 = self.nlp_model.encode(student_text.lower(), convert_to_tensor=True)
-        embedding_2 = self.nlp_model.encode(reference_answer.lower(), convert_to_tensor=True)
+        import torch  # already loaded by load_models, so this is just a lookup
+
+        # Convert text to unit-length vector embeddings to capture semantic meaning.
+        # inference_mode skips autograd bookkeeping we never use.
+        with torch.inference_mode():
+            row = self._q_row.get(question_id)
+            if row is not None:
+                embedding_1 = self._encode_cached(student_text.lower())
+                embedding_2 = self.q_ref_embs[row]
+            else:
+                # Unknown reference: encode both sentences in one batch (one forward pass instead of two)
+                embedding_1, embedding_2 = self.nlp_model.encode(
+                    [student_text.lower(), reference_answer],
+                    convert_to_numpy=True, batch_size=2, normalize_embeddings=True
+                )
 
         # Calculate Cosine Similarity (direction match between vectors)
-        cosine_scores = util.cos_sim(embedding_1, embedding_2)
-        score = float(cosine_scores[0][0])
+        score = cosine_similarity(embedding_1, embedding_2)
         
         # Convert 0-1 score to percentage
         final_grade = max(0, score) * 100
@@ -135,6 +353,20 @@ class AudioAutoGrader:
             "status": status
         }
 
+def to_wav_bytes(audio):
+    """Encodes a float32 recording as an in-memory 16-bit WAV for playback."""
+    from scipy.io.wavfile import write
+
+    buffer = io.BytesIO()
+    write(buffer, SAMPLE_RATE, (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16))
+    return buffer.getvalue()
+
+# Cache the grader itself as a process-wide singleton. Keeping it in st.session_state
+# would build a separate instance for every browser session.
+@st.cache_resource(show_spinner="Loading AI Models...")
+def get_grader():
+    return AudioAutoGrader()
+
 # --- STREAMLIT UI ---
 def main():
     st.title("🎤 AI Oral Quiz Grader")
@@ -147,18 +379,20 @@ def main():
         pass_threshold = st.slider("Pass Threshold", 0.0, 1.0, 0.65)
         st.caption("Adjust how strict the AI grading is.")
 
-    # Initialize the Grader class in Session State to persist across re-runs
-    if 'grader' not in st.session_state:
-        with st.spinner("Loading AI Models..."):
-            st.session_state.grader = AudioAutoGrader()
+    # One grader (and one copy of the models) is shared by every session
+    grader = get_grader()
     
     # Track the current question so it doesn't change when buttons are clicked
     if 'current_question' not in st.session_state:
         st.session_state.current_question = None
 
+    # Each student works through their own shuffled pass over the question bank
+    if 'question_order' not in st.session_state:
+        st.session_state.question_order = grader.new_question_order()
+
     # Handler for generating a new question
     if st.button("📝 Get New Question"):
-        st.session_state.current_question = st.session_state.grader.get_random_question()
+        st.session_state.current_question = grader.next_question(st.session_state.question_order)
         # Reset previous grading results
         if 'last_result' in st.session_state:
             del st.session_state.last_result
@@ -171,18 +405,21 @@ def main():
         duration = st.slider("⏱️ Recording Duration (seconds)", 5, 30, 10)
         
         if st.button("🔴 Record Answer"):
-            with st.spinner(f"Recording for {duration} seconds... Speak now!"):
-                audio_file = st.session_state.grader.record_audio(duration=duration)
+            with st.spinner(f"Recording (up to {duration} seconds)... Speak now!"):
+                audio = grader.record_audio(duration=duration)
             
-            if audio_file and os.path.exists(audio_file):
+            recorded = audio is not None and audio.size > 0
+            if recorded:
                 st.success("Recording complete!")
                 # Allow user to verify their recording
-                st.audio(audio_file, format="audio/wav")
+                st.audio(to_wav_bytes(audio), format="audio/wav")
             
             with st.spinner("Transcribing and Grading..."):
-                if audio_file:
-                    student_text = st.session_state.grader.transcribe(audio_file, context_keywords=q['keywords'])
-                    result = st.session_state.grader.grade_response(student_text, q['reference'], threshold=pass_threshold)
+                if recorded:
+                    student_text = grader.transcribe(audio, context_keywords=q['keywords'], question_id=q['id'])
+                    result = grader.grade_response(
+                        student_text, q['reference_lc'], threshold=pass_threshold, question_id=q['id']
+                    )
                 else:
                     student_text = ""
                     result = {"grade": 0, "status": "ERROR", "similarity_score": 0}